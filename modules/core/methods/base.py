@@ -29,15 +29,129 @@ __all__ = ("CRUDMethod",
            )
 
 import os
-import re
+
+from functools import lru_cache
+from io import BytesIO
 
 from gluon import current
 from gluon.storage import Storage
 
+# Cache for resolved view templates
+VIEWS = {}
+
+# Cache for custom view template sources
+TEMPLATES = {}
+
+# =============================================================================
+@lru_cache(maxsize=1024)
+def view_stem(name, component_name=None):
+    """
+        Get the file name prefix of resource-specific view templates
+
+        Args:
+            name: the resource name
+            component_name: the component alias
+
+        Returns:
+            the file name prefix, e.g. "person_address_"
+    """
+
+    if component_name:
+        return "%s_%s_" % (name, component_name)
+    else:
+        return "%s_" % name
+
+# =============================================================================
+@lru_cache(maxsize=128)
+def views_folder(folder, prefix):
+    """
+        Get the path of the views folder for a controller
+
+        Args:
+            folder: the application folder
+            prefix: the controller prefix
+
+        Returns:
+            the folder path
+    """
+
+    return os.path.join(folder, "views", prefix)
+
+# =============================================================================
+def is_filter_key(key):
+    """
+        Check whether a URL variable name is a filter expression, same
+        as matching the regex ".+[.].+|.*[(].+[)].*", but without regex
+
+        Args:
+            key: the variable name
+
+        Returns:
+            bool
+    """
+
+    if "\n" in key:
+        # Regex "." does not match newlines, so only the
+        # first line can match
+        key = key.split("\n", 1)[0]
+    if "." in key[1:-1]:
+        return True
+    index = key.find("(")
+    return index >= 0 and ")" in key[index+2:]
+
+# =============================================================================
+def template_source(path):
+    """
+        Get the source of a view template as file-like object; the
+        contents are cached per file and re-read whenever the modification
+        time or the size of the file changes
+
+        Args:
+            path: the file path
+
+        Returns:
+            BytesIO
+    """
+
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = TEMPLATES.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, "rb") as template:
+            source = template.read()
+        TEMPLATES[path] = cached = (version, source)
+
+    return BytesIO(cached[1])
+
 # =============================================================================
 class CRUDMethod:
     """ CRUD Access Method """
 
+    # Default method if none specified, by (component, multiple, record)
+    DEFAULT_METHOD = {(False, False, False): "list",
+                      (False, False, True): "read",
+                      (True, False, False): "read",
+                      (True, False, True): "read",
+                      (True, True, False): "list",
+                      (True, True, True): "read",
+                      }
+
+    # Whether the class implements a widget method
+    _widget_override = False
+
+    # -------------------------------------------------------------------------
+    def __init_subclass__(cls, **kwargs):
+        """
+            Determine once per subclass whether it overrides the
+            widget method stub
+        """
+
+        super().__init_subclass__(**kwargs)
+
+        cls._widget_override = cls.widget is not CRUDMethod.widget
+
+    # -------------------------------------------------------------------------
     def __init__(self):
 
         self.request = None
@@ -46,7 +160,6 @@ class CRUDMethod:
         self.download_url = None
         self.hide_filter = False
 
-
         self.prefix = None
         self.name = None
         self.resource = None
@@ -89,31 +202,21 @@ class CRUDMethod:
         response = current.response
         self.download_url = response.s3.download_url
 
-        # Override request method
-        self.method = method if method else r.method
-
         # Find the target resource and record
-        if r.component:
-            component = r.component
+        component = r.component
+        if component:
             resource = component
             self.record_id = self._record_id(r)
-            if not self.method:
-                if component.multiple and not r.component_id:
-                    self.method = "list"
-                else:
-                    self.method = "read"
-            if component.link:
-                actuate_link = r.actuate_link()
-                if not actuate_link:
-                    resource = component.link
+            if component.link and not r.actuate_link():
+                resource = component.link
+            key = (True, bool(component.multiple), bool(r.component_id))
         else:
             self.record_id = r.id
             resource = r.resource
-            if not self.method:
-                if r.id or r.method in ("read", "display"):
-                    self.method = "read"
-                else:
-                    self.method = "list"
+            key = (False, False, bool(r.id))
+
+        # Override request method, or fall back to default method
+        self.method = method or r.method or self.DEFAULT_METHOD[key]
 
         self.prefix = resource.prefix
         self.name = resource.name
@@ -124,35 +227,35 @@ class CRUDMethod:
         if r.interactive:
             hide_filter = attr.get("hide_filter")
             if isinstance(hide_filter, dict):
-                component_name = r.component_name
-                if component_name in hide_filter:
-                    hide_filter = hide_filter[component_name]
-                elif "_default" in hide_filter:
-                    hide_filter = hide_filter["_default"]
-                else:
-                    hide_filter = None
+                hide_filter = hide_filter.get(r.component_name,
+                                              hide_filter.get("_default"))
             if hide_filter is None:
-                hide_filter = r.component is not None
+                hide_filter = component is not None
             self.hide_filter = hide_filter
         else:
             self.hide_filter = True
 
         # Apply method
-        if widget_id and hasattr(self, "widget"):
-            output = self.widget(r,
-                                 method = self.method,
-                                 widget_id = widget_id,
-                                 **attr)
+        if widget_id:
+            if self._widget_override:
+                output = self.widget(r,
+                                     method = self.method,
+                                     widget_id = widget_id,
+                                     **attr)
+            else:
+                # Widget method stub would return None anyway
+                output = None
         else:
             output = self.apply_method(r, **attr)
 
             # Redirection
             if self.next and resource.lastid:
-                self.next = str(self.next)
-                placeholder = "%5Bid%5D"
-                self.next = self.next.replace(placeholder, resource.lastid)
-                placeholder = "[id]"
-                self.next = self.next.replace(placeholder, resource.lastid)
+                next_url = str(self.next)
+                if "%5Bid%5D" in next_url or "[id]" in next_url:
+                    lastid = resource.lastid
+                    next_url = next_url.replace("%5Bid%5D", lastid) \
+                                       .replace("[id]", lastid)
+                self.next = next_url
             if not response.error:
                 r.next = self.next
 
@@ -247,29 +350,22 @@ class CRUDMethod:
         if not method:
             method = self.method
 
-        if r.component is None:
-            table = r.table
-            record_id = r.id
-        else:
-            table = r.component.table
-            record_id = r.component_id
-
-            if method == "create":
-                # Is creating a new component record allowed without
-                # permission to update the master record?
-                writable = current.s3db.get_config(r.tablename,
-                                                   "ignore_master_access",
-                                                   )
-                if not isinstance(writable, (tuple, list)) or \
-                   r.component_name not in writable:
-                    master_access = has_permission("update",
-                                                   r.table,
-                                                   record_id = r.id,
-                                                   )
-                    if not master_access:
-                        return False
-
-        return has_permission(method, table, record_id=record_id)
+        component = r.component
+        if component is None:
+            # Master resource
+            return has_permission(method, r.table, record_id=r.id)
+
+        if method == "create":
+            # Is creating a new component record allowed without
+            # permission to update the master record?
+            s3db = current.s3db
+            writable = s3db.get_config(r.tablename, "ignore_master_access")
+            if (not isinstance(writable, (tuple, list)) or \
+                r.component_name not in writable) and \
+               not has_permission("update", r.table, record_id=r.id):
+                return False
+
+        return has_permission(method, component.table, record_id=r.component_id)
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -294,11 +390,17 @@ class CRUDMethod:
 
             if not component.multiple and not component_id:
                 # Enforce first component record
+                # => look up only the record ID, no need to load the
+                #    record here as add_filter clears the component anyway
                 table = component.table
-                pkey = table._id.name
-                component.load(start=0, limit=1)
-                if len(component):
-                    component_id = component.records().first()[pkey]
+                rows = component.select([table._id.name],
+                                        start = 0,
+                                        limit = 1,
+                                        virtual = False,
+                                        as_rows = True,
+                                        )
+                if rows:
+                    component_id = rows.first()[str(table._id)]
                     if link and master_id:
                         r.link_id = link.link_id(master_id, component_id)
                     r.component_id = component_id
@@ -314,8 +416,8 @@ class CRUDMethod:
         return None
 
     # -------------------------------------------------------------------------
-    @staticmethod
-    def _view(r, default):
+    @classmethod
+    def _view(cls, r, default):
         """
             Get the path to the view template
 
@@ -330,22 +432,93 @@ class CRUDMethod:
         folder = r.folder
         prefix = r.controller
 
-        exists = os.path.exists
-        join = os.path.join
-
         settings = current.deployment_settings
         theme = settings.get_theme()
         theme_layouts = settings.get_theme_layouts()
 
+        component_name = r.component_name if r.component else None
+
+        # Look up the view in the cache
+        key = (folder, theme, theme_layouts, prefix, r.name, component_name, default)
+        resolved = VIEWS.get(key)
+        if resolved is not None and resolved[0]:
+            try:
+                return template_source(resolved[0])
+            except OSError:
+                # Custom view has been removed => resolve again
+                VIEWS.pop(key, None)
+                TEMPLATES.pop(resolved[0], None)
+                resolved = None
+
+        if resolved is None:
+            resolved = cls._resolve_view(folder,
+                                         prefix,
+                                         r.name,
+                                         component_name,
+                                         default,
+                                         theme = theme,
+                                         theme_layouts = theme_layouts,
+                                         )
+            # Do not cache in debug mode, so that new view
+            # templates are picked up without restart
+            if not settings.get_base_debug():
+                VIEWS[key] = resolved
+
+        custom, view, general = resolved
+        if custom:
+            # There is a view specific to this page
+            # NB This should normally include {{extend layout.html}}
+            # Pass view as file not str to work in compiled mode
+            return template_source(custom)
+        if general:
+            # Pass the mapping for the general view to the View
+            current.response.s3.views[default] = general
+
+        return view
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _resolve_view(folder,
+                      prefix,
+                      name,
+                      component_name,
+                      default,
+                      theme = "default",
+                      theme_layouts = "default",
+                      ):
+        """
+            Find the view template for a CRUD request in the file system
+
+            Args:
+                folder: the application folder
+                prefix: the controller prefix
+                name: the resource name
+                component_name: the component alias (if any)
+                default: name of the default view template
+                theme: the current theme
+                theme_layouts: the location of the theme layouts
+
+            Returns:
+                tuple (custom, view, general), where:
+                    - custom is the file path of a custom view for this
+                      page in the theme (or None)
+                    - view is the path of the view template
+                    - general is the mapping for a general view for this
+                      page type in the theme (or None)
+        """
+
+        exists = os.path.exists
+        join = os.path.join
+
+        general = None
+
         if theme != "default":
             # See if there is a Custom View for this Theme
             view = join(folder, "modules", "templates", theme_layouts, "views",
-                        "%s_%s_%s" % (prefix, r.name, default))
+                        "%s_%s_%s" % (prefix, name, default))
             if exists(view):
                 # There is a view specific to this page
-                # NB This should normally include {{extend layout.html}}
-                # Pass view as file not str to work in compiled mode
-                return open(view, "rb")
+                return view, None, None
             else:
                 if "/" in default:
                     subfolder, default_ = default.split("/", 1)
@@ -358,29 +531,24 @@ class CRUDMethod:
                     # NB This should not include {{extend layout.html}}
                     if subfolder:
                         subfolder = "%s/" % subfolder
-                    # Pass this mapping to the View
-                    current.response.s3.views[default] = \
-                        "../modules/templates/%s/views/%s_%s" % (theme_layouts,
-                                                                 subfolder,
-                                                                 default_,
-                                                                 )
-
-        if r.component:
-            view = "%s_%s_%s" % (r.name, r.component_name, default)
-            path = join(folder, "views", prefix, view)
+                    general = "../modules/templates/%s/views/%s_%s" % (theme_layouts,
+                                                                       subfolder,
+                                                                       default_,
+                                                                       )
+
+        views = views_folder(folder, prefix)
+        if component_name:
+            view = view_stem(name, component_name) + default
+            path = join(views, view)
             if exists(path):
-                return "%s/%s" % (prefix, view)
-            else:
-                view = "%s_%s" % (r.name, default)
-                path = join(folder, "views", prefix, view)
-        else:
-            view = "%s_%s" % (r.name, default)
-            path = join(folder, "views", prefix, view)
+                return None, "%s/%s" % (prefix, view), general
+        view = view_stem(name) + default
+        path = join(views, view)
 
         if exists(path):
-            return "%s/%s" % (prefix, view)
+            return None, "%s/%s" % (prefix, view), general
         else:
-            return default
+            return None, default, general
 
     # -------------------------------------------------------------------------
     @staticmethod
@@ -398,7 +566,7 @@ class CRUDMethod:
                 additional view variables to be added automatically
         """
 
-        if r.interactive and isinstance(output, dict):
+        if attr and r.interactive and isinstance(output, dict):
             for key in attr:
                 handler = attr[key]
                 if callable(handler):
@@ -436,10 +604,7 @@ class CRUDMethod:
                 the filtered URL vars (Storage)
         """
 
-        regex_filter = re.compile(r".+\..+|.*\(.+\).*")
-
-        return Storage((k, v) for k, v in get_vars.items()
-                              if not regex_filter.match(k))
+        return Storage((k, v) for k, v in get_vars.items() if not is_filter_key(k))
 
     # -------------------------------------------------------------------------
     @staticmethod
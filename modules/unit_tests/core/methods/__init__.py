@@ -1,3 +1,4 @@
 from .anonymize import *
+from .base import *
 from .crud import *
 from .grouped import *
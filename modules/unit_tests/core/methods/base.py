@@ -0,0 +1,552 @@
+# Eden Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/core/methods/base.py
+#
+import itertools
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from gluon import current, Field
+from gluon.storage import Storage
+
+from core import CRUDMethod, CRUDRequest, s3_meta_fields
+from core.methods.base import TEMPLATES, VIEWS, is_filter_key, template_source
+
+from unit_tests import run_suite
+
+# =============================================================================
+class FilterKeyTests(unittest.TestCase):
+    """ Test detection of filter expressions in URL vars """
+
+    # -------------------------------------------------------------------------
+    def testIsFilterKey(self):
+        """ Test is_filter_key against the filter key regex """
+
+        regex_filter = re.compile(r".+\..+|.*\(.+\).*")
+
+        for length in range(7):
+            for chars in itertools.product("a.()\n", repeat=length):
+                key = "".join(chars)
+                self.assertEqual(is_filter_key(key),
+                                 bool(regex_filter.match(key)),
+                                 msg = repr(key),
+                                 )
+
+    # -------------------------------------------------------------------------
+    def testRemoveFilters(self):
+        """ Test removal of filters from URL vars """
+
+        get_vars = {"organisation.name__like": "Test*",
+                    "~.id__belongs": "1,2",
+                    "(name)": "Test",
+                    "\na.b": "x",
+                    "format": "json",
+                    "x.": "y",
+                    }
+
+        result = CRUDMethod._remove_filters(get_vars)
+        self.assertEqual(result, {"\na.b": "x",
+                                  "format": "json",
+                                  "x.": "y",
+                                  })
+
+# =============================================================================
+class DefaultMethodTests(unittest.TestCase):
+    """ Test resolution of the default method in CRUDMethod.__call__ """
+
+    class TestMethod(CRUDMethod):
+        """ CRUDMethod stub for testing """
+
+        # Component ID to set in _record_id (simulates enforcing the
+        # first record of a single component)
+        set_component_id = None
+
+        def _record_id(self, r):
+            component_id = self.set_component_id
+            if component_id:
+                r.component_id = component_id
+            return r.component_id
+
+        def apply_method(self, r, **attr):
+            return {}
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def resource(tablename, multiple=True):
+        """ Fake resource """
+
+        prefix, name = tablename.split("_", 1)
+        return Storage(prefix = prefix,
+                       name = name,
+                       tablename = tablename,
+                       multiple = multiple,
+                       )
+
+    # -------------------------------------------------------------------------
+    def request(self, record_id=None, component=None, component_id=None, method=None):
+        """ Fake request """
+
+        return Storage(resource = self.resource("org_organisation"),
+                       id = record_id,
+                       component = component,
+                       component_name = component.name if component else None,
+                       component_id = component_id,
+                       method = method,
+                       interactive = False,
+                       actuate_link = lambda: True,
+                       )
+
+    # -------------------------------------------------------------------------
+    def testMasterDefault(self):
+        """ Test default method for master resource """
+
+        assertEqual = self.assertEqual
+
+        handler = self.TestMethod()
+
+        handler(self.request())
+        assertEqual(handler.method, "list")
+
+        handler(self.request(record_id=1))
+        assertEqual(handler.method, "read")
+
+    # -------------------------------------------------------------------------
+    def testSingleComponentDefault(self):
+        """ Test default method for single component """
+
+        assertEqual = self.assertEqual
+
+        handler = self.TestMethod()
+        component = self.resource("org_office", multiple=False)
+
+        handler(self.request(record_id=1, component=component))
+        assertEqual(handler.method, "read")
+
+        handler(self.request(record_id=1, component=component, component_id=3))
+        assertEqual(handler.method, "read")
+
+    # -------------------------------------------------------------------------
+    def testMultipleComponentDefault(self):
+        """ Test default method for multiple component """
+
+        assertEqual = self.assertEqual
+
+        handler = self.TestMethod()
+        component = self.resource("org_office")
+
+        handler(self.request(record_id=1, component=component))
+        assertEqual(handler.method, "list")
+
+        handler(self.request(record_id=1, component=component, component_id=3))
+        assertEqual(handler.method, "read")
+
+    # -------------------------------------------------------------------------
+    def testComponentIDFromRecordID(self):
+        """ Test default method when _record_id sets the component ID """
+
+        assertEqual = self.assertEqual
+
+        handler = self.TestMethod()
+        handler.set_component_id = 3
+
+        # Single component
+        component = self.resource("org_office", multiple=False)
+        r = self.request(record_id=1, component=component)
+
+        handler(r)
+        assertEqual(r.component_id, 3)
+        assertEqual(handler.record_id, 3)
+        assertEqual(handler.method, "read")
+
+        # Multiple component
+        component = self.resource("org_office")
+        r = self.request(record_id=1, component=component)
+
+        handler(r)
+        assertEqual(r.component_id, 3)
+        assertEqual(handler.record_id, 3)
+        assertEqual(handler.method, "read")
+
+    # -------------------------------------------------------------------------
+    def testExplicitMethod(self):
+        """ Test that explicit and request methods override the default """
+
+        assertEqual = self.assertEqual
+
+        handler = self.TestMethod()
+
+        handler(self.request(method="report"))
+        assertEqual(handler.method, "report")
+
+        handler(self.request(record_id=1, method="report"), method="update")
+        assertEqual(handler.method, "update")
+
+# =============================================================================
+class RecordIDTests(unittest.TestCase):
+    """ Test CRUDMethod._record_id with single components """
+
+    @classmethod
+    def setUpClass(cls):
+
+        s3db = current.s3db
+
+        # Define master table
+        s3db.define_table("crudtest_master",
+                          Field("name"),
+                          *s3_meta_fields())
+
+        # Define component tables
+        s3db.define_table("crudtest_detail",
+                          Field("master_id", "reference crudtest_master"),
+                          Field("name"),
+                          *s3_meta_fields())
+
+        s3db.define_table("crudtest_linked",
+                          Field("name"),
+                          *s3_meta_fields())
+
+        s3db.define_table("crudtest_master_linked",
+                          Field("master_id", "reference crudtest_master"),
+                          Field("linked_id", "reference crudtest_linked"),
+                          *s3_meta_fields())
+
+        # Declare single components
+        s3db.add_components("crudtest_master",
+                            crudtest_detail = {"joinby": "master_id",
+                                               "multiple": False,
+                                               },
+                            crudtest_linked = {"link": "crudtest_master_linked",
+                                               "joinby": "master_id",
+                                               "key": "linked_id",
+                                               "actuate": "replace",
+                                               "multiple": False,
+                                               },
+                            )
+
+        current.db.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+
+        # Drop all test tables
+        db.crudtest_master_linked.drop()
+        db.crudtest_linked.drop()
+        db.crudtest_detail.drop()
+        db.crudtest_master.drop()
+
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        db = current.db
+
+        # Create master records (the other one for control)
+        mtable = db.crudtest_master
+        self.master_id = mtable.insert(name="Master")
+        self.other_id = mtable.insert(name="Other")
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testSingleComponent(self):
+        """ Test enforcing the first record of a single component """
+
+        assertEqual = self.assertEqual
+
+        master_id = self.master_id
+
+        # Create component records, the first for the other master
+        ctable = current.db.crudtest_detail
+        ctable.insert(master_id=self.other_id, name="Other Detail")
+        detail_id = ctable.insert(master_id=master_id, name="Detail")
+
+        r = CRUDRequest(prefix = "crudtest",
+                        name = "master",
+                        args = [str(master_id), "detail"],
+                        http = "GET",
+                        )
+        assertEqual(r.component_id, None)
+
+        record_id = CRUDMethod._record_id(r)
+
+        # First component record of this master becomes the target
+        assertEqual(record_id, detail_id)
+        assertEqual(r.component_id, detail_id)
+        assertEqual(r.link_id, None)
+
+        # Component is filtered by the record ID
+        ctable.insert(master_id=master_id, name="Another Detail")
+        rows = r.component.select(["id"], as_rows=True)
+        assertEqual([row[str(ctable._id)] for row in rows], [detail_id])
+
+    # -------------------------------------------------------------------------
+    def testSingleLinkedComponent(self):
+        """ Test enforcing the first record of a single linked component """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        master_id = self.master_id
+
+        # Create component records and links, the first for the other master
+        ctable = db.crudtest_linked
+        ltable = db.crudtest_master_linked
+        other_linked_id = ctable.insert(name="Other Linked")
+        ltable.insert(master_id=self.other_id, linked_id=other_linked_id)
+        linked_id = ctable.insert(name="Linked")
+        link_id = ltable.insert(master_id=master_id, linked_id=linked_id)
+
+        r = CRUDRequest(prefix = "crudtest",
+                        name = "master",
+                        args = [str(master_id), "linked"],
+                        http = "GET",
+                        )
+        assertEqual(r.component_id, None)
+        assertEqual(r.link_id, None)
+
+        record_id = CRUDMethod._record_id(r)
+
+        # First linked record of this master becomes the target,
+        # and the link is actuated (=> component record ID returned)
+        assertEqual(record_id, linked_id)
+        assertEqual(r.component_id, linked_id)
+        assertEqual(r.link_id, link_id)
+
+        # Component is filtered by the record ID
+        another_id = ctable.insert(name="Another Linked")
+        ltable.insert(master_id=master_id, linked_id=another_id)
+        rows = r.component.select(["id"], as_rows=True)
+        assertEqual([row[str(ctable._id)] for row in rows], [linked_id])
+
+# =============================================================================
+class ViewTests(unittest.TestCase):
+    """ Test view template resolution and caching in CRUDMethod._view """
+
+    THEME = "CRUDMethodTest"
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        # Application folder with theme views folder
+        self.folder = folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(folder, "views", "org"))
+        os.makedirs(os.path.join(folder, "modules", "templates", self.THEME, "views"))
+
+        # Use test theme
+        s3 = current.response.s3
+        self.s3 = Storage(theme = s3.theme,
+                          theme_layouts = s3.theme_layouts,
+                          views = s3.views,
+                          )
+        s3.theme = s3.theme_layouts = self.THEME
+        s3.views = {}
+
+        # Turn off debug mode
+        settings = current.deployment_settings
+        self.debug = settings.base.debug
+        settings.base.debug = False
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.deployment_settings.base.debug = self.debug
+        current.response.s3.update(self.s3)
+
+        # Remove cache entries for the test folder
+        folder = self.folder
+        for key in [k for k in VIEWS if k[0] == folder]:
+            del VIEWS[key]
+
+        for path in [p for p in TEMPLATES if p.startswith(folder)]:
+            del TEMPLATES[path]
+
+        shutil.rmtree(folder)
+
+    # -------------------------------------------------------------------------
+    def create(self, *path, content=b""):
+        """
+            Create a file in the test folder
+
+            Args:
+                path: the path elements relative to the test folder
+                content: the file content
+
+            Returns:
+                the file path
+        """
+
+        path = os.path.join(self.folder, *path)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    # -------------------------------------------------------------------------
+    def request(self, component_name=None, name="office"):
+        """ Fake request """
+
+        component = Storage(name=component_name) if component_name else None
+
+        return Storage(folder = self.folder,
+                       controller = "org",
+                       name = name,
+                       component = component,
+                       component_name = component_name,
+                       )
+
+    # -------------------------------------------------------------------------
+    def cached(self):
+        """ Get the cached views for the test folder """
+
+        folder = self.folder
+        return {k: v for k, v in VIEWS.items() if k[0] == folder}
+
+    # -------------------------------------------------------------------------
+    def testGeneralViewMapping(self):
+        """ Test that cache hits re-apply the general view mapping """
+
+        assertEqual = self.assertEqual
+
+        self.create("modules", "templates", self.THEME, "views", "_list.html")
+        mapping = "../modules/templates/%s/views/_list.html" % self.THEME
+
+        s3 = current.response.s3
+
+        view = CRUDMethod._view(self.request(), "list.html")
+        assertEqual(view, "list.html")
+        assertEqual(s3.views, {"list.html": mapping})
+        assertEqual(len(self.cached()), 1)
+
+        # Cache hit with fresh views mapping
+        s3.views = {}
+        view = CRUDMethod._view(self.request(), "list.html")
+        assertEqual(view, "list.html")
+        assertEqual(s3.views, {"list.html": mapping})
+        assertEqual(len(self.cached()), 1)
+
+    # -------------------------------------------------------------------------
+    def testComponentView(self):
+        """ Test preference of component views, and fallbacks """
+
+        assertEqual = self.assertEqual
+
+        # No resource-specific view => default
+        view = CRUDMethod._view(self.request("staff"), "read.html")
+        assertEqual(view, "read.html")
+
+        self.create("views", "org", "office_list.html")
+        self.create("views", "org", "office_staff_list.html")
+
+        # Component view preferred
+        view = CRUDMethod._view(self.request("staff"), "list.html")
+        assertEqual(view, "org/office_staff_list.html")
+
+        # Fallback to resource view
+        view = CRUDMethod._view(self.request("asset"), "list.html")
+        assertEqual(view, "org/office_list.html")
+
+        # Master resource view
+        view = CRUDMethod._view(self.request(), "list.html")
+        assertEqual(view, "org/office_list.html")
+
+    # -------------------------------------------------------------------------
+    def testDebugMode(self):
+        """ Test that views are not cached in debug mode """
+
+        assertEqual = self.assertEqual
+
+        current.deployment_settings.base.debug = True
+
+        view = CRUDMethod._view(self.request(), "list.html")
+        assertEqual(view, "list.html")
+        assertEqual(self.cached(), {})
+
+        # New view template is picked up immediately
+        self.create("views", "org", "office_list.html")
+        view = CRUDMethod._view(self.request(), "list.html")
+        assertEqual(view, "org/office_list.html")
+        assertEqual(self.cached(), {})
+
+    # -------------------------------------------------------------------------
+    def testTemplateSource(self):
+        """ Test that rewritten templates are re-read """
+
+        assertEqual = self.assertEqual
+
+        path = self.create("custom.html", content=b"first")
+        assertEqual(template_source(path).read(), b"first")
+
+        # Rewrite with different size
+        self.create("custom.html", content=b"second")
+        assertEqual(template_source(path).read(), b"second")
+
+        # Rewrite with same size, but later modification time
+        stat = os.stat(path)
+        self.create("custom.html", content=b"SECOND")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assertEqual(template_source(path).read(), b"SECOND")
+
+    # -------------------------------------------------------------------------
+    def testCustomViewRemoved(self):
+        """ Test fallback when a cached custom view is removed """
+
+        assertEqual = self.assertEqual
+        assertIn = self.assertIn
+        assertNotIn = self.assertNotIn
+
+        custom = self.create("modules", "templates", self.THEME, "views",
+                             "org_office_read.html",
+                             content = b"custom",
+                             )
+        self.create("views", "org", "office_read.html")
+
+        view = CRUDMethod._view(self.request(), "read.html")
+        assertEqual(view.read(), b"custom")
+        assertEqual(list(self.cached().values()), [(custom, None, None)])
+        assertIn(custom, TEMPLATES)
+
+        # Remove the custom view => fall back to resource view
+        os.remove(custom)
+        view = CRUDMethod._view(self.request(), "read.html")
+        assertEqual(view, "org/office_read.html")
+
+        # Stale cache entries have been replaced or dropped
+        assertEqual(list(self.cached().values()),
+                    [(None, "org/office_read.html", None)])
+        assertNotIn(custom, TEMPLATES)
+
+        # Custom view without resource view => fall back to default view
+        custom = self.create("modules", "templates", self.THEME, "views",
+                             "org_site_read.html",
+                             content = b"custom",
+                             )
+        r = self.request(name="site")
+        assertEqual(CRUDMethod._view(r, "read.html").read(), b"custom")
+
+        os.remove(custom)
+        assertEqual(CRUDMethod._view(r, "read.html"), "read.html")
+        assertNotIn(custom, TEMPLATES)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        FilterKeyTests,
+        DefaultMethodTests,
+        RecordIDTests,
+        ViewTests,
+    )
+
+# END ========================================================================